@@ -0,0 +1,177 @@
+"""
+Check div_equal against brute force on small puzzles, then time
+the old set-based partition search on LabeledInt pieces, as it used to
+run, and on integer piece ids, against div_equal.
+Run with 'python3 benchmark.py' from this directory.
+"""
+
+
+import itertools
+import random
+import time
+
+from ostomachion import div_equal, setup
+
+
+class LabeledInt(int):
+    """
+    An integer that keeps a label with it, as pieces used to be.
+    """
+    def __new__(cls, _label, *args, **kwargs):
+        return super().__new__(cls, *args, **kwargs)
+
+    def __init__(self, label, *_args, **_kwargs):
+        super().__init__()
+        self.label = label
+
+    def __eq__(self, other):
+        try:
+            return super().__eq__(other) and self.label == other.label
+        except AttributeError:
+            return super().__eq__(other)
+
+    def __hash__(self):
+        return hash((int(self), self.label))
+
+
+def time_call(function, *args, repeats=5):
+    """The result of function and the best time of a few calls"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return (result, best)
+
+
+def old_find_sub_with_sum(pieces, num_sum, area=int):
+    """
+    The old find_sub_with_sum: iterate through the parts of a set of pieces
+    with the given sum, as pairs (part, remainder) of sets of pieces,
+    where area(piece) is the area of a piece
+    """
+    new_pieces = pieces.copy()
+    popped = set()
+    while new_pieces:
+        piece = new_pieces.pop()
+        if area(piece) == num_sum:
+            yield (frozenset({piece}), new_pieces.union(popped))
+        elif area(piece) < num_sum:
+            for combo, remainder in old_find_sub_with_sum(
+                    new_pieces, num_sum - area(piece), area):
+                yield (combo.union({piece}), remainder.union(popped))
+        popped.add(piece)
+
+
+def old_div_equal(pieces, num_of_parts, area=int):
+    """
+    The old div_equal: iterate through the ways of dividing a set of pieces
+    into parts with equal sums, as sets of sets of pieces,
+    each coming once for every order of its parts
+    """
+    if num_of_parts == 0 and not pieces:
+        yield frozenset({frozenset()})
+    if num_of_parts == 1:
+        yield frozenset({frozenset(pieces)})
+    elif num_of_parts > 0 and pieces:
+        part_sum = sum(area(piece) for piece in pieces) // num_of_parts
+        for part, remainder in old_find_sub_with_sum(pieces, part_sum, area):
+            for combo in old_div_equal(remainder, num_of_parts - 1, area):
+                yield combo.union({part})
+
+
+def as_sets(combos, pieces):
+    """
+    The combos as sets of sets of pieces, like the old div_equal,
+    which ran on sets and set unions of the pieces
+    """
+    return {frozenset(frozenset(pieces[piece] for piece in part)
+                      for part in combo)
+            for combo in combos}
+
+
+def brute_force(areas, num_of_parts, pairs, kinds):
+    """
+    Every way of dividing the pieces, trying every part for every piece,
+    as a set of sorted tuples of parts, with each piece replaced by its kind
+    """
+    ways = set()
+    for assignment in itertools.product(range(num_of_parts),
+                                        repeat=len(areas)):
+        parts = [[] for _ in range(num_of_parts)]
+        for piece, part in enumerate(assignment):
+            parts[part].append(piece)
+        if (len({sum(areas[piece] for piece in part)
+                 for part in parts}) == 1 and
+                not any(first in part and second in part
+                        for part in parts for first, second in pairs)):
+            ways.add(tuple(sorted(tuple(sorted(kinds[piece]
+                                               for piece in part))
+                                  for part in parts)))
+    return ways
+
+
+def validate_partitions(trials=500, max_pieces=7, seed=0):
+    """
+    Check div_equal against brute force on small random puzzles,
+    with and without interchangeable pieces: every way has to come
+    exactly once
+    """
+    rng = random.Random(seed)
+    for _ in range(trials):
+        areas = [rng.randint(0, 3) for _ in range(rng.randint(1, max_pieces))]
+        num_of_parts = rng.randint(1, 4)
+        pairs = {tuple(rng.sample(range(len(areas)), 2))
+                 for _ in range(rng.randint(0, 3)) if len(areas) > 1}
+        neighbours = [sorted({other for pair in pairs if piece in pair
+                              for other in pair if other != piece})
+                      for piece in range(len(areas))]
+        for interchangeable in (False, True):
+            if interchangeable:
+                kinds = [(area, tuple(piece_neighbours)) for area,
+                         piece_neighbours in zip(areas, neighbours)]
+            else:
+                kinds = range(len(areas))
+            found = [tuple(sorted(tuple(sorted(kinds[piece]
+                                               for piece in part))
+                                  for part in way))
+                     for way in div_equal(areas, num_of_parts, pairs,
+                                          interchangeable=interchangeable)]
+            expected = brute_force(areas, num_of_parts, pairs, kinds)
+            if len(found) != len(set(found)) or set(found) != expected:
+                raise AssertionError(
+                    'div_equal({}, {}, {}, interchangeable={}): {} ways, '
+                    '{} distinct, {} expected'.format(
+                        areas, num_of_parts, pairs, interchangeable,
+                        len(found), len(set(found)), len(expected)))
+    print('div_equal agrees with brute force on {} puzzles'.format(trials))
+
+
+def main(num_of_parts=4):
+    """
+    Compare the old search on the two kinds of pieces with div_equal
+    """
+    areas, labels, _ = setup()
+    labeled = [LabeledInt(label[0], area)
+               for area, label in zip(areas, labels)]
+    ids = range(len(areas))
+
+    combos, search = time_call(
+        lambda: list(div_equal(areas, num_of_parts)))
+    print('search                      partitions       time')
+    for name, pieces, area in [
+            ('old sets of LabeledInt', labeled, int),
+            ('old sets of ids', ids, areas.__getitem__)]:
+        found, old_search = time_call(
+            lambda: set(old_div_equal(set(pieces), num_of_parts, area)),
+            repeats=1)
+        if found != as_sets(combos, pieces):
+            raise AssertionError('{} disagrees with div_equal'.format(name))
+        print('{:26}  {:10}  {:7.1f}ms'.format(
+            name, len(found), old_search * 1e3))
+    print('{:26}  {:10}  {:7.1f}ms'.format(
+        'div_equal on ids', len(combos), search * 1e3))
+
+if __name__ == '__main__':
+    validate_partitions()
+    main()
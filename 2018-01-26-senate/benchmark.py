@@ -0,0 +1,69 @@
+"""
+Compare the parsers for session pages on saved pages.
+Run with 'python3 benchmark.py [directory]', where the directory holds
+.htm/.html pages, at any depth, or the json files of a ResponseCache
+(./fixtures by default, or ./senate_cache after running main once).
+"""
+
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from senate_palindromes import PARSERS, parse_votes
+
+
+FIXTURE_DIR = './fixtures'
+
+
+def load_pages(directory):
+    """The session pages saved in a directory and its subdirectories"""
+    pages = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            if name.endswith(('.htm', '.html')):
+                with open(path) as file:
+                    page = file.read()
+            elif name.endswith('.json'):
+                with open(path) as file:
+                    page = json.load(file)['text']
+            else:
+                continue
+            # skip the index page
+            if '<table' in page:
+                pages.append(page)
+    return pages
+
+
+def benchmark(pages, repeats=3):
+    """Print the throughput and peak memory of each parser"""
+    size = sum(len(page) for page in pages)
+    results = {}
+    print('{} pages, {:.1f} MB'.format(len(pages), size / 1e6))
+    print('parser  pages/s     MB/s  peak memory')
+    for parser in PARSERS:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            results[parser] = [parse_votes(page, parser) for page in pages]
+        seconds = (time.perf_counter() - start) / repeats
+
+        tracemalloc.start()
+        for page in pages:
+            parse_votes(page, parser)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print('{:6}  {:7.1f}  {:7.2f}  {:8.2f} MB'.format(
+            parser, len(pages) / seconds, size / seconds / 1e6, peak / 1e6))
+
+    first, *others = results.values()
+    if any(other != first for other in others):
+        print('the parsers disagree!')
+
+
+if __name__ == '__main__':
+    benchmark(load_pages(sys.argv[1] if len(sys.argv) > 1 else FIXTURE_DIR))
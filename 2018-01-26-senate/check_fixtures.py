@@ -0,0 +1,198 @@
+"""
+Check the scraper against the pages in ./fixtures, served locally
+with http.server: the votes of every session have to match parse_votes
+on its saved page, also when the server fails each request once,
+and incremental scrapes, through a cache or into a VoteStore,
+have to keep up as sessions go by.
+Run with 'python3 check_fixtures.py' from this directory.
+"""
+
+
+import functools
+import os
+import re
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from senate_palindromes import (ResponseCache, VoteStore, get_all_votes,
+                                get_session_links, make_session, parse_votes,
+                                update_store)
+
+
+FIXTURE_DIR = './fixtures'
+PAGE_DIR = os.path.join('legislative', 'LIS', 'roll_call_lists')
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the files of a directory, answering the first request
+    for each path with 503 Service Unavailable if the server's fail_first.
+    The paths asked for are kept in the server's requested.
+    """
+    def do_GET(self):
+        self.server.requested.append(self.path)
+        if self.server.fail_first and self.path not in self.server.failed:
+            self.server.failed.add(self.path)
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def serve(directory=FIXTURE_DIR, fail_first=False):
+    """
+    Serve directory on a free local port for the duration,
+    giving the base url to scrape and the server.
+    """
+    handler = functools.partial(FixtureHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.fail_first = fail_first
+    server.failed = set()
+    server.requested = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield ('http://127.0.0.1:{}'.format(server.server_port), server)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def expected_votes(links, base_url, directory=FIXTURE_DIR):
+    """The votes of the linked sessions, parsed from the saved pages"""
+    votes = {}
+    for senate_session, link in links.items():
+        path = os.path.join(directory, *link[len(base_url):].split('/'))
+        with open(path) as file:
+            for vote_number, result in parse_votes(file.read()).items():
+                votes[(senate_session, vote_number)] = result
+    return votes
+
+
+def check_votes():
+    """Scrape every session and compare with the saved pages"""
+    with serve() as (base_url, _server):
+        links = get_session_links(make_session(), base_url)
+        pages = os.listdir(os.path.join(FIXTURE_DIR, PAGE_DIR))
+        assert len(links) == len(pages), (sorted(links), pages)
+
+        votes = get_all_votes(base_url=base_url)
+        assert votes == expected_votes(links, base_url)
+    print('get_all_votes agrees with parse_votes on {} sessions, '
+          '{} votes'.format(len(links), len(votes)))
+
+
+def check_retries():
+    """Scrape with every page failing once before it's served"""
+    with serve(fail_first=True) as (base_url, server):
+        session = make_session(backoff=0)
+        votes = get_all_votes(session, base_url)
+        links = get_session_links(session, base_url)
+        assert votes == expected_votes(links, base_url)
+        assert len(server.failed) == len(links) + 1, server.failed
+    print('get_all_votes retried {} pages answered with 503'.format(
+        len(server.failed)))
+
+
+def edit(path, old, new):
+    """Replace old with new in a file, moving its modification time on"""
+    modified = os.stat(path).st_mtime + 60
+    with open(path) as file:
+        text = file.read()
+    with open(path, 'w') as file:
+        file.write(text.replace(old, new, 1))
+    os.utime(path, (modified, modified))
+
+
+def new_vote(vote_number):
+    """A row for a vote of the 115th Congress - 1st Session"""
+    return ('<tr><td class="contenttext" align="left"><a href="/legislative/'
+            'LIS/roll_call_votes/vote1151/vote_115_1_{0:05d}.htm">{0}</a>'
+            '&nbsp;(51-49)</td></tr>\n'.format(vote_number))
+
+
+def sessions_going_by(directory):
+    """
+    Copy the fixtures into directory and change them as the 1st session
+    of the 115th Congress goes by, yielding its page after each stage:
+    first the latest session, then with another vote and over,
+    as the 2nd session appears, then changed even though it's over.
+    """
+    shutil.copytree(FIXTURE_DIR, directory)
+    index = os.path.join(directory, 'legislative', 'votes.htm')
+    first = os.path.join(directory, PAGE_DIR, 'vote_menu_115_1.htm')
+    with open(index) as file:
+        second = re.search(r'<a href="[^"]*vote_menu_115_2\.htm">.*\n',
+                           file.read()).group()
+
+    edit(index, second, '')
+    yield first
+    edit(first, '</th></tr>\n', '</th></tr>\n' + new_vote(25))
+    edit(index, '</div>', second + '</div>')
+    yield first
+    edit(first, '</th></tr>\n', '</th></tr>\n' + new_vote(26))
+    yield first
+
+
+def check_sessions_going_by(scrape):
+    """
+    Scrape with scrape(base_url, directory), which gives the votes,
+    as the sessions in a copy of the fixtures in directory go by:
+    the page of a session has to be asked for until it was scraped
+    after a newer session appeared, and not after that
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = os.path.join(directory, 'fixtures')
+        with serve(fixtures) as (base_url, server):
+            stages = sessions_going_by(fixtures)
+            for stage, page in enumerate(stages):
+                server.requested.clear()
+                votes = scrape(base_url, directory)
+                links = get_session_links(make_session(), base_url)
+                expected = expected_votes(links, base_url, fixtures)
+                asked = any(path.endswith(os.path.basename(page))
+                            for path in server.requested)
+                if stage < 2:
+                    assert votes == expected, stage
+                    assert asked, stage
+                else:
+                    assert votes != expected and not asked, stage
+                    assert ('115th Congress - 1st Session', '26') in expected
+
+
+def check_incremental():
+    """Scrape incrementally through a cache as sessions go by"""
+    def scrape(base_url, directory):
+        cache = ResponseCache(os.path.join(directory, 'cache'))
+        return get_all_votes(base_url=base_url, cache=cache,
+                             incremental=True)
+
+    check_sessions_going_by(scrape)
+    print('incremental scrapes keep asking for a session until '
+          'a newer one appears')
+
+
+def check_store():
+    """Update a VoteStore as sessions go by"""
+    store = VoteStore(':memory:')
+
+    def scrape(base_url, _directory):
+        update_store(store, base_url=base_url)
+        return store.votes()
+
+    check_sessions_going_by(scrape)
+    store.close()
+    print('update_store keeps scraping a session until '
+          'a newer one appears')
+
+if __name__ == '__main__':
+    check_votes()
+    check_retries()
+    check_incremental()
+    check_store()
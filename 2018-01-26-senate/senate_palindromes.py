@@ -4,67 +4,412 @@ and get palindromic votes.
 """
 
 
+import hashlib
+import html
+import json
+import os
 import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+SENATE_URL = 'https://www.senate.gov'
+CACHE_DIR = './senate_cache'
+DATABASE_FILE = './senate_votes.sqlite3'
+# how parse_votes reads pages by default, see PARSERS
+PARSER = 'scan'
+CONCURRENCY = 8
+RETRIES = 3
+BACKOFF = 0.5
+
+
+def make_session(concurrency=CONCURRENCY, retries=RETRIES, backoff=BACKOFF):
+    """
+    A session keeping up to concurrency connections open,
+    retrying failed requests with exponentially growing waits.
+    """
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=concurrency,
+                          pool_maxsize=concurrency, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ResponseCache:
+    """
+    Pages saved in a directory, one json file per url,
+    along with the ETag and Last-Modified headers they came with
+    and whether they were of the current session when saved.
+    """
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        """The file a url is saved in"""
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def __contains__(self, url):
+        return os.path.exists(self.path(url))
+
+    def load(self, url):
+        """The saved entry for a url, or None"""
+        try:
+            with open(self.path(url)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def is_final(self, url):
+        """
+        Whether the page of a url was saved once its session was over,
+        so it won't change any more
+        """
+        entry = self.load(url)
+        return entry is not None and not entry.get('current', True)
+
+    def write(self, url, entry):
+        """Save an entry, replacing the file in one go"""
+        path = self.path(url)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(entry, file)
+        os.replace(path + '.tmp', path)
+
+    def save(self, url, response, current=True):
+        """Save a successful response"""
+        self.write(url, {
+            'url': url, 'text': response.text,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'current': current})
+
+    def get(self, session, url, revalidate=True, current=True):
+        """
+        The text of a url. A saved page is used as is unless revalidate,
+        in which case the server is asked whether it changed.
+        current is whether the page may still change,
+        as the page of the current session or the index can.
+        """
+        entry = self.load(url)
+        if entry is not None and not revalidate:
+            return entry['text']
 
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = session.get(url, headers=headers)
+        if entry is not None and response.status_code == 304:
+            if entry.get('current', True) != current:
+                entry['current'] = current
+                self.write(url, entry)
+            return entry['text']
+        response.raise_for_status()
+        self.save(url, response, current)
+        return response.text
 
-def get_session_links():
+
+def fetch(url, session, cache=None, revalidate=True, current=True):
+    """The text of a url, going through cache if there is one"""
+    if cache is not None:
+        return cache.get(session, url, revalidate, current)
+    response = session.get(url)
+    response.raise_for_status()
+    return response.text
+
+
+def get_session_links(session=None, base_url=SENATE_URL, cache=None):
     """
     Get the urls for each session of the Senate.
     """
-    votes_url = 'https://www.senate.gov/legislative/votes.htm'
-    response = requests.get(votes_url)
-    soup_html = BeautifulSoup(response.text, 'html.parser')
+    if session is None:
+        session = make_session()
+    votes_url = base_url + '/legislative/votes.htm'
+    soup_html = BeautifulSoup(fetch(votes_url, session, cache),
+                              'html.parser')
     links = soup_html.select('.newspaperDisplay_3column > a')
 
-    return {link.text: 'https://www.senate.gov' + link.get('href')
+    return {link.text: base_url + link.get('href')
             for link in links}
 
 
-def get_votes(session_link):
+VOTE_REGEX = re.compile(r'(\d+).\((\d+)-(\d+)\)')
+TABLE_REGEX = re.compile(r'<table\b.*?</table\s*>', re.DOTALL | re.IGNORECASE)
+ROW_REGEX = re.compile(r'<tr\b', re.IGNORECASE)
+CELL_REGEX = re.compile(r'<td\b[^>]*>(.*?)</td\s*>', re.DOTALL | re.IGNORECASE)
+TAG_REGEX = re.compile(r'<[^>]*>')
+
+
+def vote_results_soup(page):
     """
-    Get a list of the votes given a link to a session.
+    The text of the first cell of each row of the first table,
+    read with BeautifulSoup.
     """
-    response = requests.get(session_link)
-    soup_html = BeautifulSoup(response.text, 'html.parser')
+    soup_html = BeautifulSoup(page, 'html.parser')
 
     table = soup_html.find('table')
     votes = table.findAll('tr')[1:]
-    vote_results = (vote.find('td').text for vote in votes)
+    return (vote.find('td').text for vote in votes)
+
+
+def vote_results_scan(page):
+    """
+    The text of the first cell of each row of the first table,
+    found by scanning for the tags without building a tree.
+    """
+    table = TABLE_REGEX.search(page).group()
+    for row in ROW_REGEX.split(table)[2:]:
+        cell = CELL_REGEX.search(row)
+        if cell is not None:
+            yield html.unescape(TAG_REGEX.sub('', cell.group(1)))
+
+
+PARSERS = {'soup': vote_results_soup, 'scan': vote_results_scan}
 
-    regex = re.compile(r'(\d+).\((\d+)-(\d+)\)')
-    vote_results_regex = (regex.fullmatch(result) for result in vote_results)
+
+def parse_votes(page, parser=None):
+    """
+    Get a dictionary of the votes in the html of a session's page.
+    parser is one of PARSERS, PARSER by default.
+    """
+    vote_results = PARSERS[parser or PARSER](page)
+    vote_results_regex = (VOTE_REGEX.fullmatch(result)
+                          for result in vote_results)
 
     return {match.group(1): (match.group(2), match.group(3))
             for match in vote_results_regex}
 
 
-def get_all_votes():
+def get_votes(session_link, session=None, cache=None, revalidate=True,
+              current=True):
+    """
+    Get a list of the votes given a link to a session.
+    current is whether the session is the current one.
+    """
+    if session is None:
+        session = make_session()
+    return parse_votes(fetch(session_link, session, cache, revalidate,
+                             current))
+
+
+def current_session(links):
+    """
+    The latest session out of the links,
+    going by the numbers in their names (e.g. 115th Congress - 2nd Session).
+    """
+    return max(links, key=lambda senate_session: tuple(
+        int(number) for number in re.findall(r'\d+', senate_session)))
+
+
+def iter_session_votes(links, session, concurrency=CONCURRENCY,
+                       cache=None, revalidate=lambda senate_session: True,
+                       current=None):
+    """
+    Iterate through pairs (session, dictionary of its votes)
+    for a dictionary of links to sessions, fetching up to concurrency
+    pages at once and yielding each as it arrives.
+    Saved pages in cache are only revalidated if revalidate(session),
+    and are saved as final unless they are of the current session.
+    """
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = {
+            executor.submit(get_votes, link, session, cache,
+                            revalidate(senate_session),
+                            senate_session == current): senate_session
+            for senate_session, link in links.items()}
+        for future in as_completed(futures):
+            yield (futures[future], future.result())
+
+
+def iter_all_votes(session=None, base_url=SENATE_URL,
+                   concurrency=CONCURRENCY, cache=None, incremental=False):
+    """
+    Iterate through all the vote results as pairs
+    ((session, vote number), result), fetching up to concurrency
+    session pages at once and yielding each page's votes as it arrives.
+
+    With a cache, pages that haven't changed aren't downloaded again.
+    With incremental as well, pages saved once their session was over
+    are used without asking, since they won't change: only the index,
+    the current session and sessions not saved since a newer one
+    appeared are requested.
+    """
+    if session is None:
+        session = make_session(concurrency)
+    links = get_session_links(session, base_url, cache)
+    current = current_session(links) if links else None
+
+    def revalidate(senate_session):
+        """Whether a saved page needs checking"""
+        return (not incremental or senate_session == current or
+                cache is None or not cache.is_final(links[senate_session]))
+
+    for senate_session, votes in iter_session_votes(
+            links, session, concurrency, cache, revalidate, current):
+        for vote_number, result in votes.items():
+            yield ((senate_session, vote_number), result)
+
+
+def get_all_votes(session=None, base_url=SENATE_URL,
+                  concurrency=CONCURRENCY, cache=None, incremental=False):
     """
     A dictionary of all the vote results.
     """
-    votes_dict = {}
-    for session, link in get_session_links().items():
-        for vote_number, result in get_votes(link).items():
-            votes_dict[session, vote_number] = result
+    return dict(iter_all_votes(session, base_url, concurrency,
+                               cache, incremental))
+
 
-    return votes_dict
+def is_palindrome(result):
+    """
+    Whether a vote result reads the same backwards.
+    """
+    string = result[0] + result[1]
+    return string == string[::-1]
 
 
 def find_palindromes(votes):
     """
-    Find palindromes in a dictionary of votes.
+    Find palindromes in a dictionary of votes
+    (or in pairs (vote, result) as iter_all_votes gives them).
     """
-    for vote, result in votes.items():
-        string = result[0] + result[1]
-        if string == string[::-1]:
+    if isinstance(votes, dict):
+        votes = votes.items()
+    for vote, result in votes:
+        if is_palindrome(result):
             yield (vote, result)
 
 
+class VoteStore:
+    """
+    Votes saved in a SQLite database, one row per vote,
+    with whether each result is a palindrome worked out once on the way in.
+    Vote numbers are kept as integers, so they sort and compare as numbers,
+    and the yeas and nays as they were parsed.
+    Each saved session is also marked complete if it was scraped
+    once it was over, so its votes won't change.
+    """
+    SCHEMA_VERSION = 3
+    SCHEMA = """
+        DROP TABLE IF EXISTS votes;
+        DROP TABLE IF EXISTS sessions;
+        CREATE TABLE sessions (
+            session TEXT NOT NULL PRIMARY KEY,
+            complete INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE votes (
+            session TEXT NOT NULL,
+            vote_number INTEGER NOT NULL,
+            yeas TEXT NOT NULL,
+            nays TEXT NOT NULL,
+            palindrome INTEGER NOT NULL,
+            PRIMARY KEY (session, vote_number)
+        ) WITHOUT ROWID;
+        CREATE INDEX palindromes ON votes (palindrome);
+    """
+
+    def __init__(self, path=DATABASE_FILE):
+        self.connection = sqlite3.connect(path)
+        version, = self.connection.execute('PRAGMA user_version').fetchone()
+        if version != self.SCHEMA_VERSION:
+            # only scraped data, so start over rather than migrate
+            self.connection.executescript(
+                self.SCHEMA +
+                'PRAGMA user_version = {};'.format(self.SCHEMA_VERSION))
+
+    def close(self):
+        """Close the database"""
+        self.connection.close()
+
+    def sessions(self, complete=None):
+        """
+        The set of saved sessions, or only those that are complete
+        or not if complete is given
+        """
+        query = 'SELECT session FROM sessions'
+        parameters = ()
+        if complete is not None:
+            query += ' WHERE complete = ?'
+            parameters = (complete,)
+        return {row[0] for row in self.connection.execute(query, parameters)}
+
+    def replace_session(self, senate_session, votes, complete=False):
+        """
+        Save the votes of a session given as a dictionary,
+        replacing whatever was saved for it, in a single transaction.
+        complete is whether the session was over when they were scraped.
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?)',
+                (senate_session, complete))
+            self.connection.execute(
+                'DELETE FROM votes WHERE session = ?', (senate_session,))
+            self.connection.executemany(
+                'INSERT INTO votes VALUES (?, ?, ?, ?, ?)',
+                ((senate_session, int(vote_number), result[0], result[1],
+                  is_palindrome(result))
+                 for vote_number, result in votes.items()))
+
+    def votes(self, senate_session=None):
+        """
+        A dictionary of the saved votes, like get_all_votes,
+        or of the votes of a single session.
+        """
+        query = 'SELECT session, vote_number, yeas, nays FROM votes'
+        parameters = ()
+        if senate_session is not None:
+            query += ' WHERE session = ?'
+            parameters = (senate_session,)
+        return {(row[0], str(row[1])): (row[2], row[3])
+                for row in self.connection.execute(query, parameters)}
+
+    def palindromes(self):
+        """
+        Iterate through the saved palindromic votes,
+        like find_palindromes, by session and vote number.
+        """
+        for row in self.connection.execute(
+                'SELECT session, vote_number, yeas, nays FROM votes '
+                'WHERE palindrome = 1 ORDER BY session, vote_number'):
+            yield ((row[0], str(row[1])), (row[2], row[3]))
+
+
+def update_store(store, session=None, base_url=SENATE_URL,
+                 concurrency=CONCURRENCY, cache=None):
+    """
+    Scrape the sessions not saved in store as complete yet,
+    which includes the current session, saving each one as it arrives.
+    """
+    if session is None:
+        session = make_session(concurrency)
+    links = get_session_links(session, base_url, cache)
+    current = current_session(links) if links else None
+    complete = store.sessions(complete=True)
+    links = {senate_session: link for senate_session, link in links.items()
+             if senate_session == current or senate_session not in complete}
+
+    for senate_session, votes in iter_session_votes(
+            links, session, concurrency, cache, current=current):
+        store.replace_session(senate_session, votes,
+                              senate_session != current)
+
+
 def main():
     """
     Do everything
     """
-    votes = get_all_votes()
-    print(*find_palindromes(votes), sep='\n')
+    store = VoteStore()
+    update_store(store, cache=ResponseCache())
+    for palindrome in store.palindromes():
+        print(palindrome)
+    store.close()
@@ -1,106 +1,340 @@
+import os
+import hashlib
+import mmap
+import struct
+from array import array
+import shutil
+from collections import deque
+from itertools import chain
+from multiprocessing import Pool
+
 STATE_LIST_FILE = './states.txt'
 WORD_LIST_FILE = './words.txt'
+CACHE_FILE = './mackerels.cache'
+CHUNK_SIZE = 20000
+BLOCK_SIZE = 1 << 20
+
+# magic, hash of the states file, hash of the cached part of the words file,
+# size in bytes of that part, number of records
+CACHE_HEADER = struct.Struct('<4s32s32sQQ')
+CACHE_MAGIC = b'MAK2'
+# one record per word: state index (NO_STATE if none), signature (0 if no state)
+CACHE_RECORD = struct.Struct('<HI')
+NO_STATE = 0xffff
 
 def read_file(path):
     with open(path, 'r') as file:
         return file.read().splitlines()
 
+def read_chunks(paths, chunk_size=CHUNK_SIZE, offset=0):
+    # lists of at most chunk_size lines, read lazily from each file in turn,
+    # starting offset bytes into the first file
+    chunk = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            offset = 0
+            for line in file:
+                chunk.append(line.decode().rstrip('\r\n'))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+def map_chunks(function, args, paths, chunk_size=CHUNK_SIZE, processes=None,
+               offset=0):
+    # function(*args, chunk) for each chunk of lines of the files, in order,
+    # spread over a process pool keeping only a few chunks in flight at any time
+    chunks = read_chunks(paths, chunk_size, offset)
+    first = next(chunks, None)
+    if first is None:
+        return
+    processes = processes or os.cpu_count()
+    with Pool(processes) as pool:
+        pending = deque()
+        for chunk in chain([first], chunks):
+            pending.append(pool.apply_async(function, args + (chunk,)))
+            if len(pending) > 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
 def read_states_words():
     states = read_file(STATE_LIST_FILE)
     words = read_file(WORD_LIST_FILE)
     return (states, words)
 
+def letter_mask(string):
+    # one bit per letter a-z, anything else is ignored
+    mask = 0
+    for char in string:
+        index = ord(char) - ord('a')
+        if 0 <= index < 26:
+            mask |= 1 << index
+    return mask
+
+def mackerel_index(state_masks, word_mask):
+    # index of the only state sharing no letters with the word, if there is one
+    found = None
+    for index, state_mask in enumerate(state_masks):
+        if not state_mask & word_mask:
+            if found is not None:
+                return None
+            found = index
+    return found
+
 def mackerel_state(states, word):
-    mackerel_states = [state for state in states if not (set(state) & set(word))]
-    if len(mackerel_states) == 1:
-        return mackerel_states[0]
+    index = mackerel_index([letter_mask(state) for state in states], letter_mask(word))
+    if index is not None:
+        return states[index]
 
-def longest_mackerel(states, words):
-    # casefold words/states
-    states = [state.casefold() for state in states]
-    words = [word.casefold() for word in words]
+class MackerelIndex:
+    # every word with a unique mackerel state, found in a single pass over the words
+    # words are kept grouped by their set of letters (signature), along with the
+    # order of the signatures of the words, and only expanded back to words by the
+    # queries that need them
+    def __init__(self, states, words):
+        # casefold words/states
+        self.states = [state.casefold() for state in states]
+        self.state_masks = [letter_mask(state) for state in self.states]
+        # signature -> index of its mackerel state, for signatures with one
+        self.signatures = {}
+        # signature -> its words, in order
+        self.groups = {}
+        # the signature of each word, in order
+        self.order = array('I')
+        # words sharing a signature (anagrams, repeated letters) share a single
+        # state check, also when the signature has no mackerel state
+        memo = {}
+        for word in words:
+            self.add(word.casefold(), memo)
 
-    words = sorted(words, key=lambda word: len(word), reverse=True)
+    @classmethod
+    def from_files(cls, states, paths, chunk_size=CHUNK_SIZE, processes=None,
+                   offset=0):
+        # build the index from word files in chunks spread over a process pool,
+        # starting offset bytes into the first file
+        index = cls(states, [])
+        for other in map_chunks(cls, (states,), paths, chunk_size, processes,
+                                offset):
+            index.merge(other)
+        return index
 
-    for word in words:
-        state = mackerel_state(states, word)
+    def merge(self, other):
+        # append the words of an index built over the same states on later words
+        self.signatures.update(other.signatures)
+        for signature, words in other.groups.items():
+            self.groups.setdefault(signature, []).extend(words)
+        self.order.extend(other.order)
+
+    def add(self, word, memo=None):
+        # add the next word, returning the index of its mackerel state or None
+        # memo keeps the state indices (or None) of signatures already checked
+        signature = letter_mask(word)
+        if signature in self.signatures:
+            state = self.signatures[signature]
+        elif memo is not None and signature in memo:
+            state = memo[signature]
+        else:
+            state = mackerel_index(self.state_masks, signature)
+            if memo is not None:
+                memo[signature] = state
+        self.add_signature(word, signature, state)
+        return state
+
+    def add_signature(self, word, signature, state):
+        # add the next word when its signature and state index are already known
         if state is not None:
-            return (word, state)
+            self.signatures[signature] = state
+            self.groups.setdefault(signature, []).append(word)
+            self.order.append(signature)
 
-def longest_mackerel_num_letters(states, words):
-    # casefold words/states
-    states = [state.casefold() for state in states]
-    words = [word.casefold() for word in words]
+    def expand(self, signatures=None):
+        # pairs (word, state) for the words with the given signatures (all by
+        # default), in word order
+        words = {}
+        for signature in self.order:
+            if signatures is None or signature in signatures:
+                if signature not in words:
+                    words[signature] = iter(self.groups[signature])
+                yield (next(words[signature]),
+                       self.states[self.signatures[signature]])
 
-    words = sorted(words, key=lambda word: len(set(word)), reverse=True)
+    def by_num_letters(self, num_letters):
+        return {signature for signature in self.groups
+                if bin(signature).count('1') == num_letters}
 
-    for word in words:
-        state = mackerel_state(states, word)
-        if state is not None:
-            return (word, state)
+    def longest_mackerel(self):
+        if self.groups:
+            return max(self.expand(), key=lambda word_state: len(word_state[0]))
 
-def longest_mackerel_ties(states, words, length):
-    # casefold words/states
-    states = [state.casefold() for state in states]
-    words = [word.casefold() for word in words]
+    def longest_mackerel_num_letters(self):
+        if self.groups:
+            num_letters = max(bin(signature).count('1') for signature in self.groups)
+            return next(self.expand(self.by_num_letters(num_letters)))
 
-    words = [word for word in words if len(word) == length]
+    def longest_mackerel_ties(self, length):
+        for word, state in self.expand():
+            if len(word) == length:
+                yield (word, state)
 
-    for word in words:
-        state = mackerel_state(states, word)
-        if state is not None:
-            yield (word, state)
+    def longest_mackerel_num_letters_ties(self, length):
+        yield from self.expand(self.by_num_letters(length))
 
-def longest_mackerel_num_letters_ties(states, words, length):
-    # casefold words/states
-    states = [state.casefold() for state in states]
-    words = [word.casefold() for word in words]
+    def count_mackerels(self):
+        counts = {state: 0 for state in self.states}
+        for signature, words in self.groups.items():
+            counts[self.states[self.signatures[signature]]] += len(words)
+        return counts
 
-    words = [word for word in words if len(set(word)) == length]
+    def find_all_mackerels(self):
+        by_state = {state: [] for state in self.states}
+        for word, state in self.expand():
+            by_state[state].append(word)
+        return by_state
 
-    for word in words:
-        state = mackerel_state(states, word)
-        if state is not None:
-            yield (word, state)
+def longest_mackerel(states, words):
+    return MackerelIndex(states, words).longest_mackerel()
 
-def count_mackerels(states, words):
-    # casefold words/states
-    states = [state.casefold() for state in states]
-    words = [word.casefold() for word in words]
+def longest_mackerel_num_letters(states, words):
+    return MackerelIndex(states, words).longest_mackerel_num_letters()
 
-    mackerels = {state: 0 for state in states}
-    for word in words:
-        state = mackerel_state(states, word)
-        if state is not None:
-            mackerels[state] += 1
-    return mackerels
+def longest_mackerel_ties(states, words, length):
+    return MackerelIndex(states, words).longest_mackerel_ties(length)
+
+def longest_mackerel_num_letters_ties(states, words, length):
+    return MackerelIndex(states, words).longest_mackerel_num_letters_ties(length)
+
+def count_mackerels(states, words):
+    return MackerelIndex(states, words).count_mackerels()
 
 def find_all_mackerels(states, words):
-    # casefold words/states
-    states = [state.casefold() for state in states]
-    words = [word.casefold() for word in words]
+    return MackerelIndex(states, words).find_all_mackerels()
 
-    mackerels = {state: [] for state in states}
+def index_chunk(states, words):
+    # MackerelIndex of a chunk of words, along with a cache record for each word
+    index = MackerelIndex(states, [])
+    memo = {}
+    records = bytearray()
     for word in words:
-        state = mackerel_state(states, word)
-        if state is not None:
-            mackerels[state].append(word)
-    return mackerels
+        state = index.add(word.casefold(), memo)
+        if state is None:
+            records += CACHE_RECORD.pack(NO_STATE, 0)
+        else:
+            records += CACHE_RECORD.pack(state, index.order[-1])
+    return (index, records)
 
-def find_longest_mackerel():
-    states = read_file(STATE_LIST_FILE)
-    words = read_file(WORD_LIST_FILE)
+def hash_prefix(path, size, block_size=BLOCK_SIZE):
+    # sha256 object over the first size bytes of a file, None if it's shorter
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while size:
+            block = file.read(min(size, block_size))
+            if not block:
+                return None
+            hasher.update(block)
+            size -= len(block)
+    return hasher
 
-    long_mack = longest_mackerel(states, words)
-    print(f'longest mackerel: {long_mack[0]}, state: {long_mack[1]}')
+def hash_lines(path, offset, hasher, block_size=BLOCK_SIZE):
+    # feed hasher the whole lines of a file after offset, returning the offset
+    # just after the last one and the number of lines
+    # a trailing word without a newline may still grow, so it's left out
+    end = offset
+    num_lines = 0
+    tail = b''
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        for block in iter(lambda: file.read(block_size), b''):
+            block = tail + block
+            cut = block.rfind(b'\n') + 1
+            hasher.update(block[:cut])
+            num_lines += block.count(b'\n')
+            end += cut
+            tail = block[cut:]
+    return (end, num_lines)
 
-def find_most_mackerels():
-    states = read_file(STATE_LIST_FILE)
-    words = read_file(WORD_LIST_FILE)
+def load_cache(path, states_hash, words_path, index):
+    # add the words cached in path to index, returning the number of bytes of the
+    # words file they cover and a sha256 object over those bytes
+    # nothing is added if the cache doesn't exist or doesn't match the start of
+    # the current words file
+    if not os.path.exists(path) or os.path.getsize(path) < CACHE_HEADER.size:
+        return (0, hashlib.sha256())
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as cache:
+            magic, cached_states_hash, words_hash, size, count = \
+                CACHE_HEADER.unpack_from(cache)
+            end = CACHE_HEADER.size + count * CACHE_RECORD.size
+            if (magic != CACHE_MAGIC or cached_states_hash != states_hash or
+                    len(cache) != end):
+                return (0, hashlib.sha256())
+            hasher = hash_prefix(words_path, size)
+            if hasher is None or hasher.digest() != words_hash:
+                return (0, hashlib.sha256())
+            # read the records in place, only decoding the words with a state
+            with memoryview(cache) as view, \
+                    view[CACHE_HEADER.size:end] as records, \
+                    open(words_path, 'rb') as words:
+                for (state, signature), line in zip(
+                        CACHE_RECORD.iter_unpack(records), words):
+                    if state != NO_STATE:
+                        word = line.decode().rstrip('\r\n').casefold()
+                        index.add_signature(word, signature, state)
+    return (size, hasher)
+
+def write_cache(path, states_hash, words_hash, size, records, append):
+    # write the cache for the first size bytes of the words file, appending
+    # records to the ones already in path if append, else starting over
+    count = len(records) // CACHE_RECORD.size
+    if append:
+        shutil.copyfile(path, path + '.tmp')
+        with open(path, 'rb') as file:
+            count += CACHE_HEADER.unpack(file.read(CACHE_HEADER.size))[4]
+    with open(path + '.tmp', 'r+b' if append else 'wb') as file:
+        file.write(CACHE_HEADER.pack(
+            CACHE_MAGIC, states_hash, words_hash, size, count))
+        file.seek(0, os.SEEK_END)
+        file.write(records)
+    os.replace(path + '.tmp', path)
+
+def cached_index(states_path=STATE_LIST_FILE, words_path=WORD_LIST_FILE,
+                 cache_path=CACHE_FILE, chunk_size=CHUNK_SIZE, processes=None):
+    # MackerelIndex over the two files, reusing the per-word results stored in
+    # cache_path and only computing words appended since it was written, over
+    # a process pool as in MackerelIndex.from_files
+    states = read_file(states_path)
+    if len(states) >= NO_STATE:
+        # state indices don't fit in the records, so don't cache anything
+        return MackerelIndex.from_files(states, [words_path], chunk_size,
+                                        processes)
+    with open(states_path, 'rb') as file:
+        states_hash = hashlib.sha256(file.read()).digest()
+    index = MackerelIndex(states, [])
+    size, hasher = load_cache(cache_path, states_hash, words_path, index)
+    new_size, num_lines = hash_lines(words_path, size, hasher)
+
+    records = bytearray()
+    for other, chunk_records in map_chunks(index_chunk, (states,), [words_path],
+                                           chunk_size, processes, size):
+        index.merge(other)
+        records += chunk_records
+
+    if new_size > size:
+        write_cache(cache_path, states_hash, hasher.digest(), new_size,
+                    records[:num_lines * CACHE_RECORD.size], size > 0)
+    return index
+
+def find_longest_mackerel(index):
+    long_mack = index.longest_mackerel()
+    print(f'longest mackerel: {long_mack[0]}, state: {long_mack[1]}')
 
-    mackerels = count_mackerels(states, words)
+def find_most_mackerels(index):
+    mackerels = index.count_mackerels()
     print(sorted(mackerels.items(), key=lambda s_w: s_w[1]))
 
 if __name__ == '__main__':
-    find_longest_mackerel()
-    find_most_mackerels()
+    index = cached_index()
+    find_longest_mackerel(index)
+    find_most_mackerels(index)
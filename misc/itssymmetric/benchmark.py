@@ -0,0 +1,181 @@
+"""
+Time the path searches in path_finding.
+Run with 'python3 benchmark.py' from this directory.
+"""
+
+
+import time
+
+from path_finding import Grid, Node, Path, setup
+
+
+def time_call(function, *args):
+    """Time consuming everything function yields, returning (count, seconds)"""
+    start = time.perf_counter()
+    count = sum(1 for _ in function(*args))
+    return (count, time.perf_counter() - start)
+
+
+def filter_after(grid, x_start, y_start, length, evens, odds):
+    """
+    Filter every touchless path afterwards,
+    checking each square against the evens or odds list
+    """
+    avoid = evens if length % 2 == 0 else odds
+    for path in grid.touchless_paths(x_start, y_start, length):
+        if all((node.node_x, node.node_y) not in avoid
+               for node in path.nodes):
+            yield path
+
+
+def benchmark_filtered(x_start=5, y_start=5, lengths=range(8, 17, 2)):
+    """Compare filtering afterwards with blocking squares during the search"""
+    grid, evens, odds = setup()
+    print('length  paths  filter afterwards  blocked in search')
+    for length in lengths:
+        count, after = time_call(filter_after, grid, x_start, y_start,
+                                 length, evens, odds)
+        _, blocked = time_call(grid.touchless_filtered, x_start, y_start,
+                               length, evens, odds)
+        print('{:6}  {:5}  {:16.3f}s  {:16.3f}s'.format(
+            length, count, after, blocked))
+
+
+def validate_counts(max_size=5, max_length=12):
+    """
+    Check count_touchless and count_symmetric against enumerating
+    every path (and checking Path.is_symmetric) on small grids
+    """
+    for x_len in range(1, max_size + 1):
+        for y_len in range(1, max_size + 1):
+            grid = Grid(x_len, y_len)
+            for length in range(1, max_length + 1):
+                for x_start in range(x_len):
+                    for y_start in range(y_len):
+                        paths = list(grid.touchless_cells(x_start, y_start,
+                                                          length))
+                        symmetric = sum(
+                            1 for cells in paths
+                            if grid.cells_to_path(cells).is_symmetric())
+                        for name, enumerated in [
+                                ('count_touchless', len(paths)),
+                                ('count_symmetric', symmetric)]:
+                            counted = getattr(grid, name)(x_start, y_start,
+                                                          length)
+                            if counted != enumerated:
+                                raise AssertionError(
+                                    'Grid({}, {}) from ({}, {}), length {}: '
+                                    '{} {}, {} enumerated'.format(
+                                        x_len, y_len, x_start, y_start,
+                                        length, counted, name, enumerated))
+    print('counts agree on grids up to {0}x{0}, lengths up to {1}'.format(
+        max_size, max_length))
+
+
+def benchmark_counts(x_start=5, y_start=5, lengths=range(13, 26, 2),
+                     max_enumerated=17):
+    """Compare counting paths with enumerating them"""
+    grid, _, _ = setup()
+    print('length     paths  counting  enumerating')
+    for length in lengths:
+        start = time.perf_counter()
+        count = grid.count_touchless(x_start, y_start, length)
+        counting = time.perf_counter() - start
+        if length <= max_enumerated:
+            _, enumerating = time_call(grid.touchless_cells,
+                                       x_start, y_start, length)
+            enumerating = '{:10.3f}s'.format(enumerating)
+        else:
+            enumerating = '{:>11}'.format('-')
+        print('{:6}  {:8}  {:7.3f}s  {}'.format(
+            length, count, counting, enumerating))
+
+
+def old_adjacent_nodes(node):
+    """
+    Node.adjacent_nodes as it was,
+    building every neighbour and dropping the ones off the grid
+    """
+    for x_diff in [-1, 1]:
+        try:
+            yield Node(node.grid, node.node_x + x_diff, node.node_y)
+        except ValueError:
+            pass
+    for y_diff in [-1, 1]:
+        try:
+            yield Node(node.grid, node.node_x, node.node_y + y_diff)
+        except ValueError:
+            pass
+
+
+def old_to_direction_trio(node0, node1, node2):
+    """
+    Node.to_direction_trio as it was,
+    checking the nodes and working out the change every time
+    """
+    if not node0.is_adjacent(node1) or not node1.is_adjacent(node2):
+        raise ValueError("Nodes not adjacent")
+    return Node.direction_change(
+        node0.node_x - node1.node_x, node0.node_y - node1.node_y,
+        node2.node_x - node1.node_x, node2.node_y - node1.node_y)
+
+
+def old_cells_to_path(grid, cells):
+    """Grid.cells_to_path as it was, with new nodes and a checked Path"""
+    return Path(grid, [Node(grid, *grid.cell_xy(cell)) for cell in cells])
+
+
+def time_per_step(function, items, steps):
+    """Time calling function on each of the items, per step"""
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - start) / steps
+
+
+def benchmark_steps(repeats=200, length=12):
+    """
+    Time the Node and Path methods per step, before and after the
+    adjacency and direction tables: finding the adjacent nodes of a node,
+    finding the direction change at a node of a path and building a Path
+    from cell ids
+    """
+    grid, _, _ = setup()
+    nodes = [Node(grid, node_x, node_y)
+             for node_x in range(grid.x_len)
+             for node_y in range(grid.y_len)] * repeats
+    paths = list(grid.touchless_cells(5, 5, length))[:2000]
+    trios = [nodes_trio
+             for path in (grid.cells_to_path(cells) for cells in paths)
+             for nodes_trio in zip(path.nodes, path.nodes[1:],
+                                   path.nodes[2:])]
+    num_adjacent = sum(1 for node in nodes[:len(nodes) // repeats]
+                       for _ in node.adjacent_nodes()) * repeats
+    num_cells = sum(map(len, paths))
+
+    steps = [
+        ('adjacent node',
+         lambda node: sum(1 for _ in old_adjacent_nodes(node)),
+         lambda node: sum(1 for _ in node.adjacent_nodes()),
+         nodes, num_adjacent),
+        ('direction change',
+         lambda trio: old_to_direction_trio(*trio),
+         lambda trio: Node.to_direction_trio(*trio),
+         trios, len(trios)),
+        ('path node',
+         lambda cells: old_cells_to_path(grid, cells),
+         grid.cells_to_path,
+         paths, num_cells),
+    ]
+    print('step                before    after')
+    for name, before, after, items, num_steps in steps:
+        print('{:16}  {:6.0f}ns  {:5.0f}ns'.format(
+            name, time_per_step(before, items, num_steps) * 1e9,
+            time_per_step(after, items, num_steps) * 1e9))
+
+
+if __name__ == '__main__':
+    benchmark_filtered()
+    validate_counts()
+    benchmark_counts()
+    benchmark_steps()
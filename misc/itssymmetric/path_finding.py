@@ -1,15 +1,81 @@
 """Find nice paths in a grid"""
 
 
+import heapq
 from enum import Enum, auto
+from multiprocessing import Pool
+
+
+# the directions, in the same order as Node.adjacent_nodes
+DIRECTION_DIFFS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+# the direction after turning one way (resp. the other way)
+TURN_ONE_WAY = [2, 3, 1, 0]
+TURN_OTHER_WAY = [3, 2, 0, 1]
 
 
 class Grid:
-    """Describes a grid"""
+    """
+    Describes a grid
+
+    Squares are also numbered by cell ids, x + y * x_len,
+    so a set of squares can be an int with those bits set.
+    """
     def __init__(self, x_len, y_len):
         self.x_len = int(x_len)
         self.y_len = int(y_len)
 
+        # the cell in each of DIRECTION_DIFFS from each cell,
+        # None if that's outside the grid
+        self.steps = []
+        # the adjacent cells of each cell,
+        # in the same order as Node.adjacent_nodes
+        self.adjacent = []
+        # masks of each cell and its adjacent cells
+        self.around = []
+        for cell in range(self.x_len * self.y_len):
+            cell_x, cell_y = self.cell_xy(cell)
+            steps = [
+                self.cell_id(cell_x + x_diff, cell_y + y_diff)
+                if (0 <= cell_x + x_diff < self.x_len and
+                    0 <= cell_y + y_diff < self.y_len) else None
+                for x_diff, y_diff in DIRECTION_DIFFS]
+            adjacent = [other for other in steps if other is not None]
+            self.steps.append(steps)
+            self.adjacent.append(adjacent)
+            self.around.append(sum(1 << other for other in adjacent + [cell]))
+
+        # masks of all cells, and of those not in the first (resp. last)
+        # column, the cells that can be reached moving right (resp. left)
+        self.everywhere = (1 << (self.x_len * self.y_len)) - 1
+        first_column = sum(1 << self.cell_id(0, node_y)
+                           for node_y in range(self.y_len))
+        self.not_first_column = self.everywhere & ~first_column
+        self.not_last_column = (
+            self.everywhere & ~(first_column << (self.x_len - 1)))
+
+        # a node for each cell, shared by everything built from cell ids
+        self.nodes = [Node(self, *self.cell_xy(cell))
+                      for cell in range(self.x_len * self.y_len)]
+
+    def cell_id(self, node_x, node_y):
+        """The cell id of a square"""
+        return node_x + node_y * self.x_len
+
+    def cell_xy(self, cell):
+        """The coordinates of a cell id"""
+        return (cell % self.x_len, cell // self.x_len)
+
+    def cells_mask(self, squares):
+        """The mask of the cells of a list of (x, y) squares in the grid"""
+        return sum(1 << self.cell_id(node_x, node_y)
+                   for node_x, node_y in set(squares)
+                   if 0 <= node_x < self.x_len and 0 <= node_y < self.y_len)
+
+    def cells_to_path(self, cells):
+        """Build a Path from a sequence of cell ids"""
+        nodes = self.nodes
+        return Path(self, [nodes[cell] for cell in cells], check=False)
+
     def check_nodes(self, nodes):
         """Checks if all nodes are in this grid and that they are adjecent"""
         if not nodes:
@@ -31,50 +97,275 @@ class Grid:
 
         return True
 
-    def touchless_paths(self, x_start, y_start, length):
+    def touchless_cells(self, x_start, y_start, length, blocked=0):
         """
         Iterate through all non-self-touching paths
-        with given start point and length
+        with given start point and length, as tuples of cell ids.
+        Paths through a cell in the mask blocked are skipped.
         """
-        def paths_rec(path, remaining_length):
+        Node(self, x_start, y_start)  # check the start is in the grid
+        start = self.cell_id(x_start, y_start)
+        if not blocked >> start & 1:
+            yield from self.extend_cells((start,), length, blocked)
+
+    def extend_cells(self, prefix, length, blocked=0):
+        """
+        Iterate through the non-self-touching paths with given length
+        starting with prefix (a non-self-touching path of cell ids),
+        in the order of touchless_cells.
+
+        A new square touches the path unless the only square of it
+        that is or is next to the new square is the current end.
+        So the path without its end is kept as a mask,
+        and each step is a single check against it.
+        """
+        adjacent = self.adjacent
+        around = self.around
+        cells = list(prefix)
+
+        def cells_rec(end, behind, remaining_length):
             """An auxillary recursive function"""
             if remaining_length == 0:
-                yield path
+                yield tuple(cells)
                 return
-            end_node = path.nodes[-1]
-            for new_node in end_node.adjacent_nodes():
-                new_path = path.add_node(new_node)
-                if not new_path.is_touching_self():
-                    for rec_path in paths_rec(new_path, remaining_length - 1):
-                        yield rec_path
-
-        initial_node = Node(self, x_start, y_start)
-        initial_path = Path(self, [initial_node])
-        for path in paths_rec(initial_path, length - 1):
-            yield path
+            behind_new = behind | 1 << end
+            for new_cell in adjacent[end]:
+                if not (around[new_cell] & behind or
+                        blocked >> new_cell & 1):
+                    cells.append(new_cell)
+                    yield from cells_rec(new_cell, behind_new,
+                                         remaining_length - 1)
+                    cells.pop()
+
+        behind = sum(1 << cell for cell in set(cells[:-1]))
+        yield from cells_rec(cells[-1], behind, length - len(cells))
+
+    def touchless_parallel(self, x_start, y_start, length, blocked=0,
+                           prefix_depth=4, processes=None, counts=False):
+        """
+        Iterate through the same paths as touchless_cells, in the same
+        order, but find the paths starting with each prefix of
+        prefix_depth steps in a process pool.
+        With counts, iterate through pairs (prefix, number of paths
+        starting with it) instead.
+        """
+        Node(self, x_start, y_start)  # check the start is in the grid
+        start = self.cell_id(x_start, y_start)
+        if blocked >> start & 1:
+            return
+        prefixes = list(self.extend_cells(
+            (start,), min(prefix_depth + 1, length), blocked))
+
+        with Pool(processes, initializer=set_worker_grid,
+                  initargs=(self.x_len, self.y_len)) as pool:
+            results = pool.imap(
+                extend_prefix,
+                [(prefix, length, blocked, counts) for prefix in prefixes])
+            for prefix, result in zip(prefixes, results):
+                if counts:
+                    yield (prefix, result)
+                else:
+                    yield from result
+
+    def reachable(self, cell, forbidden, steps):
+        """
+        The mask of the cells reachable from cell in at most steps steps
+        without going through a cell in the mask forbidden
+        """
+        x_len = self.x_len
+        allowed = self.everywhere & ~forbidden
+        not_last = self.not_last_column
+        not_first = self.not_first_column
+
+        reach = 1 << cell
+        for _ in range(steps):
+            new_reach = reach | allowed & (
+                (reach >> 1) & not_last | (reach << 1) & not_first |
+                reach >> x_len | reach << x_len)
+            if new_reach == reach:
+                break
+            reach = new_reach
+        return reach
+
+    def count_touchless(self, x_start, y_start, length, blocked=0):
+        """
+        The number of paths touchless_cells would give,
+        without going through them one by one.
 
-    def touchless_filtered(self, x_start, y_start, length, evens, odds):
-        """Filter based on paths that avoid off parity squares"""
+        The number of ways to finish a path only depends on its end,
+        the remaining length and the cells the rest of the path could
+        still reach: those not blocked, not touching the path so far
+        and close enough to the end. So that's all that's remembered.
+        """
+        Node(self, x_start, y_start)  # check the start is in the grid
+        adjacent = self.adjacent
+        around = self.around
+        known_counts = {}
+
+        def count_rec(end, forbidden, remaining_length):
+            """An auxillary recursive function"""
+            if remaining_length == 0:
+                return 1
+            key = (end, remaining_length,
+                   self.reachable(end, forbidden, remaining_length))
+            if key not in known_counts:
+                forbidden_new = forbidden | around[end]
+                known_counts[key] = sum(
+                    count_rec(new_cell, forbidden_new, remaining_length - 1)
+                    for new_cell in adjacent[end]
+                    if not forbidden >> new_cell & 1)
+            return known_counts[key]
+
+        start = self.cell_id(x_start, y_start)
+        if blocked >> start & 1:
+            return 0
+        return count_rec(start, blocked, length - 1)
+
+    def count_symmetric(self, x_start, y_start, length, blocked=0):
+        """
+        The number of paths symmetric_cells would give.
+
+        Unlike count_touchless, this goes through the paths one by one:
+        the second half of a symmetric path replays the turns of the
+        first half, so the ways to finish a path depend on every turn
+        made so far, not just on its end and the cells it can reach.
+        """
+        return sum(1 for _ in self.symmetric_cells(x_start, y_start,
+                                                   length, blocked))
+
+    def touchless_paths(self, x_start, y_start, length):
+        """
+        Iterate through all non-self-touching paths
+        with given start point and length
+        """
+        for cells in self.touchless_cells(x_start, y_start, length):
+            yield self.cells_to_path(cells)
+
+    def symmetric_cells(self, x_start, y_start, length, blocked=0):
+        """
+        Iterate through the non-self-touching paths with given start point
+        and length that are symmetric (see Path.is_symmetric),
+        as tuples of cell ids in the order of touchless_cells.
+        Paths through a cell in the mask blocked are skipped.
+
+        A path is symmetric when its list of direction changes reads the
+        same backwards, or the same backwards with left and right swapped.
+        So only the first half of the direction changes is searched,
+        and each path is finished by reading them back.
+        """
+        turns = length - 2
+        if turns <= 0:
+            yield from self.touchless_cells(x_start, y_start, length, blocked)
+            return
+
+        def search(swapped):
+            """
+            Paths reading the same backwards (with left and right swapped
+            if swapped), as pairs (directions, cells)
+            """
+            cells = [self.cell_id(x_start, y_start)]
+            directions = []
+            changes = []  # 0 for straight on, 1 and 2 for turning either way
+
+            def cells_rec(end, behind):
+                """An auxillary recursive function"""
+                step = len(directions)
+                if step == length - 1:
+                    yield (tuple(directions), tuple(cells))
+                    return
+
+                if step == 0:
+                    new_directions = range(4)
+                else:
+                    last = directions[-1]
+                    options = (last, TURN_ONE_WAY[last], TURN_OTHER_WAY[last])
+                    change = step - 1
+                    if swapped and change == turns - 1 - change:
+                        # the middle change is its own mirror image
+                        new_directions = [last]
+                    elif change <= turns - 1 - change:
+                        new_directions = sorted(options)
+                    else:
+                        mirrored = changes[turns - 1 - change]
+                        if swapped and mirrored:
+                            mirrored = 3 - mirrored
+                        new_directions = [options[mirrored]]
+
+                behind_new = behind | 1 << end
+                for direction in new_directions:
+                    new_cell = self.steps[end][direction]
+                    if (new_cell is None or self.around[new_cell] & behind or
+                            blocked >> new_cell & 1):
+                        continue
+                    if step:
+                        changes.append(options.index(direction))
+                    directions.append(direction)
+                    cells.append(new_cell)
+                    yield from cells_rec(new_cell, behind_new)
+                    cells.pop()
+                    directions.pop()
+                    if step:
+                        changes.pop()
+
+            yield from cells_rec(cells[0], 0)
+
+        Node(self, x_start, y_start)  # check the start is in the grid
+        if blocked >> self.cell_id(x_start, y_start) & 1:
+            return
+        # a path can be symmetric both ways, so merge and skip repeats
+        previous = None
+        for path_directions, path_cells in heapq.merge(search(False),
+                                                       search(True)):
+            if path_directions != previous:
+                yield path_cells
+            previous = path_directions
+
+    def parity_blocked(self, length, evens, odds):
+        """The mask of the off parity squares for paths of some length"""
         if length % 2 == 0:
-            avoid = evens
-        else:
-            avoid = odds
+            return self.cells_mask(evens)
+        return self.cells_mask(odds)
 
-        for path in self.touchless_paths(x_start, y_start, length):
-            if all((node.node_x, node.node_y) not in avoid
-                   for node in path.nodes):
-                yield path
+    def touchless_filtered(self, x_start, y_start, length, evens, odds):
+        """Filter based on paths that avoid off parity squares"""
+        blocked = self.parity_blocked(length, evens, odds)
+        for cells in self.touchless_cells(x_start, y_start, length, blocked):
+            yield self.cells_to_path(cells)
 
     def touchless_symmetric(self, x_start, y_start, length, evens, odds):
         """Filter to only symmetric paths"""
-        for path in self.touchless_filtered(x_start, y_start,
-                                            length, evens, odds):
-            if path.is_symmetric():
-                yield path
+        blocked = self.parity_blocked(length, evens, odds)
+        for cells in self.symmetric_cells(x_start, y_start, length, blocked):
+            yield self.cells_to_path(cells)
+
+
+# the grid of a worker process of Grid.touchless_parallel
+WORKER_GRID = None
+
+
+def set_worker_grid(x_len, y_len):
+    """Set up the grid in a worker process"""
+    # pylint: disable = W0603
+    global WORKER_GRID
+    WORKER_GRID = Grid(x_len, y_len)
+
+
+def extend_prefix(args):
+    """
+    Find the paths starting with a prefix in a worker process,
+    or only how many there are if count_only
+    """
+    prefix, length, blocked, count_only = args
+    paths = WORKER_GRID.extend_cells(prefix, length, blocked)
+    if count_only:
+        return sum(1 for _ in paths)
+    return list(paths)
 
 
 class Node:
     """Descibes a point in a grid"""
+    __slots__ = ('grid', 'node_x', 'node_y')
+
     def __init__(self, grid, node_x, node_y):
         self.grid = grid
         self.node_x = node_x
@@ -92,16 +383,10 @@ class Node:
 
     def adjacent_nodes(self):
         """Iterate through adjacent nodes"""
-        for x_diff in [-1, 1]:
-            try:
-                yield Node(self.grid, self.node_x + x_diff, self.node_y)
-            except ValueError:
-                pass
-        for y_diff in [-1, 1]:
-            try:
-                yield Node(self.grid, self.node_x, self.node_y + y_diff)
-            except ValueError:
-                pass
+        grid = self.grid
+        nodes = grid.nodes
+        for cell in grid.adjacent[grid.cell_id(self.node_x, self.node_y)]:
+            yield nodes[cell]
 
     def is_in_grid(self, grid):
         """Checks if this node is in another grid"""
@@ -114,15 +399,22 @@ class Node:
         Detects the change in direction from node0 to node 2.
         The nodes must be adjacent.
         """
+        direction = DIRECTION_CHANGES.get((
+            node0.node_x - node1.node_x, node0.node_y - node1.node_y,
+            node2.node_x - node1.node_x, node2.node_y - node1.node_y))
+        if direction is not None:
+            return direction
+
         if not node0.is_adjacent(node1) or not node1.is_adjacent(node2):
             raise ValueError("Nodes not adjacent")
+        raise ValueError
 
-        diff1_x = node0.node_x - node1.node_x
-        diff1_y = node0.node_y - node1.node_y
-
-        diff2_x = node2.node_x - node1.node_x
-        diff2_y = node2.node_y - node1.node_y
-
+    @staticmethod
+    def direction_change(diff1_x, diff1_y, diff2_x, diff2_y):
+        """
+        Work out the change in direction given the differences from the
+        middle node to the first and last nodes, see to_direction_trio
+        """
         if diff1_x * diff2_x > 0:
             return Direction.backwards
         if diff1_x * diff2_x < 0:
@@ -147,10 +439,12 @@ class Node:
 
 class Path:
     """Descibes a path in a grid"""
-    def __init__(self, grid, nodes):
+    __slots__ = ('grid', 'nodes')
+
+    def __init__(self, grid, nodes, check=True):
         self.grid = grid
         self.nodes = nodes
-        if not self.grid.check_nodes(nodes):
+        if check and not self.grid.check_nodes(nodes):
             raise ValueError("Invalid nodes argument")
 
     def __str__(self):
@@ -211,6 +505,13 @@ class Direction(Enum):
         return self
 
 
+# Node.to_direction_trio for each pair of differences from the middle node
+DIRECTION_CHANGES = {
+    diff1 + diff2: Node.direction_change(*diff1, *diff2)
+    for diff1 in DIRECTION_DIFFS for diff2 in DIRECTION_DIFFS
+}
+
+
 def setup():
     """Set up grid, evens and odds"""
     grid = Grid(11, 11)
@@ -2,6 +2,15 @@
 Tools for solving nonograms
 """
 
+import copy
+import functools
+import multiprocessing
+import sys
+import time
+from multiprocessing import Pool
+
+LINE_CACHE_SIZE = 1 << 16
+
 
 def possibility_iterate(clues, row_or_column_count, offset=0):
     """
@@ -29,14 +38,114 @@ def possibility_iterate(clues, row_or_column_count, offset=0):
 def poss_convert(possibility, clues, row_or_column_count):
     """
     Converts a tuple of indices (representing locations of blocks)
-    to a tuple of bools (representing whether a square is shaded).
+    to a bitmask where bit k is set if square k is shaded.
     """
-    # I think this works since False is immutable
-    output = [False] * row_or_column_count
+    # the line length isn't needed, but is kept so callers can stay the same
+    # pylint: disable = W0613
+    output = 0
     for location, length in zip(possibility, clues):
-        for k in range(location, location + length):
-            output[k] = True
-    return tuple(output)
+        output |= ((1 << length) - 1) << location
+    return output
+
+
+def solve_line(clues, row_or_column_count, filled, empty):
+    """
+    Find the squares shaded (resp. unshaded) in every way of filling
+    the column/row with the given clue that agrees with the squares
+    already known to be shaded (filled) or unshaded (empty).
+
+    Returns the bitmasks (filled, empty) of these squares,
+    or None if no way of filling the line fits.
+
+    Rather than going through every possibility, this works out
+    which blocks can be placed in each prefix and suffix of the line,
+    so it takes time proportional to the number of clues
+    times the length of the line.
+    """
+    clues = [clue for clue in clues if clue]
+    length = row_or_column_count
+    count = len(clues)
+
+    # before[j][i]: the first j blocks fit in squares 0 to i - 1
+    before = [[False] * (length + 1) for _ in range(count + 1)]
+    before[0][0] = True
+    for i in range(1, length + 1):
+        before[0][i] = before[0][i - 1] and not filled >> (i - 1) & 1
+    for j in range(1, count + 1):
+        clue = clues[j - 1]
+        block = (1 << clue) - 1
+        for i in range(1, length + 1):
+            start = i - clue
+            before[j][i] = (
+                (before[j][i - 1] and not filled >> (i - 1) & 1) or
+                (start >= 0 and not empty >> start & block and (
+                    before[0][start] if j == 1 else
+                    start >= 1 and not filled >> (start - 1) & 1 and
+                    before[j - 1][start - 1])))
+
+    # after[j][i]: the blocks from j onwards fit in squares i to the end
+    after = [[False] * (length + 1) for _ in range(count + 1)]
+    after[count][length] = True
+    for i in range(length - 1, -1, -1):
+        after[count][i] = after[count][i + 1] and not filled >> i & 1
+    for j in range(count - 1, -1, -1):
+        clue = clues[j]
+        block = (1 << clue) - 1
+        for i in range(length - 1, -1, -1):
+            end = i + clue
+            after[j][i] = (
+                (after[j][i + 1] and not filled >> i & 1) or
+                (end <= length and not empty >> i & block and (
+                    after[count][end] if j == count - 1 else
+                    end < length and not filled >> end & 1 and
+                    after[j + 1][end + 1])))
+
+    if not before[count][length]:
+        return None
+
+    # squares that some fitting placement leaves unshaded (resp. shades)
+    can_be_empty = 0
+    for i in range(length):
+        if not filled >> i & 1 and any(
+                before[j][i] and after[j][i + 1] for j in range(count + 1)):
+            can_be_empty |= 1 << i
+    can_be_filled = 0
+    for j, clue in enumerate(clues):
+        block = (1 << clue) - 1
+        for start in range(length - clue + 1):
+            end = start + clue
+            if (not empty >> start & block and
+                    (before[0][start] if j == 0 else
+                     start >= 1 and not filled >> (start - 1) & 1 and
+                     before[j][start - 1]) and
+                    (after[count][end] if j == count - 1 else
+                     end < length and not filled >> end & 1 and
+                     after[j + 1][end + 1])):
+                can_be_filled |= block << start
+
+    full = (1 << length) - 1
+    return (full & ~can_be_empty, full & ~can_be_filled)
+
+
+def set_line_cache_size(maxsize=LINE_CACHE_SIZE):
+    """
+    Start a new least recently used cache of solve_line results,
+    keeping at most maxsize (or unlimited if None) of them.
+    The cache is keyed by the clues, length and known squares,
+    so it is shared by every row and column of every puzzle
+    in this process.
+    """
+    # pylint: disable = W0603
+    global cached_solve_line
+    cached_solve_line = functools.lru_cache(maxsize)(solve_line)
+
+
+def line_cache_info():
+    """Hits, misses, maximum and current size of the solve_line cache"""
+    return cached_solve_line.cache_info()
+
+
+set_line_cache_size()
 
 
 class RowOrColumn:
@@ -45,40 +154,141 @@ class RowOrColumn:
     # too few public methods
     # pylint: disable = R0903
 
-    def __init__(self, clues, row_or_column_count, index):
+    def __init__(self, clues, row_or_column_count, index,
+                 enumerate_all=False):
         self.clues = clues
-        self.possibilities = set(poss_convert(poss, clues, row_or_column_count)
-                                 for poss in possibility_iterate(
-                                     clues,
-                                     row_or_column_count))
+        self.clues_key = tuple(clues)
+        self.length = row_or_column_count
         self.index = index
+        self.full = (1 << row_or_column_count) - 1
+        self.filled = self.empty = 0
+        # every possibility is only kept if asked for,
+        # otherwise solve_line works from the known squares
+        self.possibilities = None
+        if enumerate_all:
+            self.possibilities = set(
+                poss_convert(poss, clues, row_or_column_count)
+                for poss in possibility_iterate(clues, row_or_column_count))
+        self.update_known()
+
+    def update_known(self, filled=0, empty=0):
+        """
+        Recompute the masks of squares shaded (resp. unshaded)
+        in every remaining possibility.
+        If there are none, every square is marked as both.
+        """
+        if self.possibilities is None:
+            known = cached_solve_line(self.clues_key, self.length,
+                                      self.filled | filled,
+                                      self.empty | empty)
+            self.filled, self.empty = known or (self.full, self.full)
+            return
+
+        filled = empty = self.full
+        for poss in self.possibilities:
+            filled &= poss
+            empty &= ~poss
+        self.filled = filled
+        self.empty = empty
 
     def refine(self, others):
         """Refines based on the contrary direction possibilities"""
+        # squares of this line that every possibility of the crossing line
+        # shades (resp. leaves unshaded)
+        filled = empty = 0
         for k, other in enumerate(others):
+            if other.filled >> self.index & 1:
+                filled |= 1 << k
+            if other.empty >> self.index & 1:
+                empty |= 1 << k
+
+        self.restrict(filled, empty)
+
+    def restrict(self, filled, empty):
+        """Only keep the possibilities shading filled and not empty"""
+        if self.possibilities is None:
+            self.update_known(filled, empty)
+        else:
             self.possibilities = {
                 poss for poss in self.possibilities
-                if any(poss[k] == other_poss[self.index]
-                       for other_poss in other.possibilities)}
+                if poss & filled == filled and not poss & empty}
+            self.update_known()
 
 
 class Puzzle:
 
     """Data for the full puzzle"""
 
-    def __init__(self, row_clues, column_clues):
+    def __init__(self, row_clues, column_clues, enumerate_all=False,
+                 observers=()):
+        # called with the puzzle after each round of refining,
+        # e.g. print_puzzle to watch it being solved
+        self.observers = list(observers)
         self.rows = [
-            RowOrColumn(clues, len(column_clues), k)
+            RowOrColumn(clues, len(column_clues), k, enumerate_all)
             for k, clues in enumerate(row_clues)
         ]
         self.columns = [
-            RowOrColumn(clues, len(row_clues), k)
+            RowOrColumn(clues, len(row_clues), k, enumerate_all)
             for k, clues in enumerate(column_clues)
         ]
 
-        self.total = (
-            sum(len(row.possibilities) for row in self.rows) +
-            sum(len(column.possibilities) for column in self.columns))
+    @property
+    def unknown(self):
+        """The number of squares not known yet"""
+        return sum(bin(row.full & ~(row.filled | row.empty)).count('1')
+                   for row in self.rows)
+
+    @property
+    def contradiction(self):
+        """Whether some row or column can't be filled in any more"""
+        return any(line.filled & line.empty
+                   for line in self.rows + self.columns)
+
+    def crossing(self, line):
+        """The lines crossing a row (resp. column): the columns (resp. rows)"""
+        if line.index < len(self.rows) and self.rows[line.index] is line:
+            return self.columns
+        return self.rows
+
+    def undecided(self):
+        """Iterate through the (row, column) of squares not known yet"""
+        for i, row in enumerate(self.rows):
+            unknown = row.full & ~(row.filled | row.empty)
+            while unknown:
+                j = (unknown & -unknown).bit_length() - 1
+                unknown &= unknown - 1
+                yield (i, j)
+
+    def get_state(self):
+        """Everything learned so far, to be given back to set_state"""
+        return tuple((line.filled, line.empty, line.possibilities)
+                     for line in self.rows + self.columns)
+
+    def set_state(self, state):
+        """Go back to what was learned at the time of get_state"""
+        for line, (filled, empty, possibilities) in zip(
+                self.rows + self.columns, state):
+            line.filled = filled
+            line.empty = empty
+            line.possibilities = possibilities
+
+    def assume(self, i, j, shaded):
+        """Set a square and refine everything that follows from it"""
+        row = self.rows[i]
+        filled, empty = row.filled, row.empty
+        if shaded:
+            row.restrict(1 << j, 0)
+        else:
+            row.restrict(0, 1 << j)
+
+        changed = (row.filled ^ filled) | (row.empty ^ empty)
+        if row.filled & row.empty:
+            return
+        self.repeat_refine(
+            [column for k, column in enumerate(self.columns)
+             if changed >> k & 1],
+            notify=False)
 
     def __str__(self):
         """
@@ -90,11 +300,9 @@ class Puzzle:
         out_string = ''
         for i, row in enumerate(self.rows):
             for j, column in enumerate(self.columns):
-                if (all(x[j] for x in row.possibilities) and
-                        all(x[i] for x in column.possibilities)):
+                if row.filled >> j & 1 and column.filled >> i & 1:
                     out_string += '█'
-                elif (all(not x[j] for x in row.possibilities) and
-                      all(not x[i] for x in column.possibilities)):
+                elif row.empty >> j & 1 and column.empty >> i & 1:
                     out_string += '░'
                 else:
                     out_string += '�'
@@ -110,21 +318,260 @@ class Puzzle:
         for column in self.columns:
             column.refine(self.rows)
 
-        self.total = (
-            sum(len(row.possibilities) for row in self.rows) +
-            sum(len(column.possibilities) for column in self.columns))
-
-        print('-' * 40)
-        print(self)
+        for observer in self.observers:
+            observer(self)
 
-    def repeat_refine(self):
-        """Refine until nothing is learned"""
-        total = self.total
-        while True:
-            self.refine()
-            if self.total == total:
+    def refine_dirty(self, lines, others, dirty):
+        """
+        Refine the lines whose bits are set in dirty, in order.
+        Returns the mask of the crossing lines with squares learned,
+        or None if some line turns out to be impossible.
+        """
+        learned = 0
+        while dirty:
+            k = (dirty & -dirty).bit_length() - 1
+            dirty &= dirty - 1
+            line = lines[k]
+            filled, empty = line.filled, line.empty
+            line.refine(others)
+            self.refinements += 1
+            if line.filled & line.empty:
+                return None
+            learned |= (line.filled ^ filled) | (line.empty ^ empty)
+        return learned
+
+    def repeat_refine(self, lines=None, notify=True):
+        """
+        Refine until nothing is learned
+        (or until some line turns out to be impossible).
+
+        Works in rounds like refine, rows then columns, but a line is only
+        refined if one of its squares was learned by a crossing line since
+        it was last refined. The first round refines the given lines,
+        or every line by default, and the columns learning from them.
+        With notify, the observers are called after each round.
+        refinements counts the line refinements done and
+        refinements_avoided the ones that refining everything each round
+        (plus a last round to see that nothing changes) would have added.
+        """
+        self.refinements = 0
+        learning_rounds = 0
+
+        if lines is None:
+            lines = self.rows + self.columns
+        dirty_rows = dirty_columns = 0
+        for line in lines:
+            if self.crossing(line) is self.columns:
+                dirty_rows |= 1 << line.index
+            else:
+                dirty_columns |= 1 << line.index
+        while dirty_rows or dirty_columns:
+            # the columns also pick up what the rows just learned
+            learned = self.refine_dirty(self.rows, self.columns, dirty_rows)
+            if learned is None:
+                break
+            dirty_rows = self.refine_dirty(self.columns, self.rows,
+                                           dirty_columns | learned)
+            if dirty_rows is None:
                 break
-            total = self.total
+            dirty_columns = 0
+            if learned or dirty_rows:
+                learning_rounds += 1
+
+            if notify:
+                for observer in self.observers:
+                    observer(self)
+
+        self.refinements_avoided = (
+            (learning_rounds + 1) * (len(self.rows) + len(self.columns)) -
+            self.refinements)
+
+    def search(self, processes=1, branch_depth=3, probe=True, timeout=None):
+        """
+        Finish a puzzle that refining alone can't solve.
+
+        After refining, an undecided square is assumed shaded and the
+        search continues from there, going back to assume it unshaded if
+        that leads to an impossible line. With probe, every undecided
+        square is first tried both ways, and set wherever one way fails.
+
+        With more than one process, the first branch_depth guesses are
+        made here and the branches below them are searched in a pool.
+
+        Returns whether a solution was found, leaving it in the puzzle.
+        Raises TimeoutError if that takes more than timeout seconds.
+        nodes counts the guesses tried and contradictions the ones that
+        led to an impossible line.
+        """
+        self.nodes = 0
+        self.contradictions = 0
+        deadline = None if timeout is None else time.time() + timeout
+
+        self.repeat_refine(notify=False)
+        if processes == 1:
+            return self.search_from_here(probe, deadline)
+
+        # breadth first down to branch_depth, keeping the live branches
+        root = self.get_state()
+        branches = [root]
+        for _ in range(branch_depth):
+            deeper = []
+            for state in branches:
+                self.set_state(state)
+                if self.contradiction:
+                    continue
+                square = next(self.undecided(), None)
+                if square is None:
+                    return True
+                for shaded in (True, False):
+                    self.set_state(state)
+                    self.assume(*square, shaded)
+                    self.nodes += 1
+                    if self.contradiction:
+                        self.contradictions += 1
+                    else:
+                        deeper.append(self.get_state())
+            branches = deeper
+
+        # observers stay in this process
+        observers, self.observers = self.observers, []
+        puzzles = []
+        for state in branches:
+            self.set_state(state)
+            puzzles.append((copy.deepcopy(self), probe, deadline))
+        self.observers = observers
+        with Pool(processes) as pool:
+            results = pool.imap_unordered(search_branch, puzzles)
+            for _ in puzzles:
+                try:
+                    state, nodes, contradictions = results.next(
+                        None if deadline is None
+                        else max(deadline - time.time(), 0))
+                except multiprocessing.TimeoutError:
+                    raise TimeoutError('nonogram search timed out') from None
+                self.nodes += nodes
+                self.contradictions += contradictions
+                if state is not None:
+                    self.set_state(state)
+                    return True
+        self.set_state(root)
+        return False
+
+    def search_from_here(self, probe=True, deadline=None):
+        """Depth first search from the current state, see search"""
+        if deadline is not None and time.time() > deadline:
+            raise TimeoutError('nonogram search timed out')
+        if probe:
+            self.probe(deadline)
+        if self.contradiction:
+            return False
+        square = next(self.undecided(), None)
+        if square is None:
+            return True
+
+        state = self.get_state()
+        for shaded in (True, False):
+            self.assume(*square, shaded)
+            self.nodes += 1
+            if self.search_from_here(probe, deadline):
+                return True
+            self.contradictions += 1
+            self.set_state(state)
+        return False
+
+    def probe(self, deadline=None):
+        """Set every undecided square that can't be one way without failing"""
+        progress = True
+        while progress and not self.contradiction:
+            progress = False
+            for i, j in list(self.undecided()):
+                if deadline is not None and time.time() > deadline:
+                    raise TimeoutError('nonogram search timed out')
+                row = self.rows[i]
+                if (row.filled | row.empty) >> j & 1:
+                    continue
+                state = self.get_state()
+                for shaded in (True, False):
+                    self.assume(i, j, shaded)
+                    self.nodes += 1
+                    failed = self.contradiction
+                    self.set_state(state)
+                    if failed:
+                        self.contradictions += 1
+                        self.assume(i, j, not shaded)
+                        progress = True
+                        break
+                if self.contradiction:
+                    return
+
+
+def search_branch(args):
+    """
+    Search one branch of Puzzle.search in a worker process.
+    Returns the solved state (or None), the nodes and the contradictions.
+    """
+    puzzle, probe, deadline = args
+    puzzle.nodes = 0
+    puzzle.contradictions = 0
+    solved = puzzle.search_from_here(probe, deadline)
+    return (puzzle.get_state() if solved else None,
+            puzzle.nodes, puzzle.contradictions)
+
+
+def print_puzzle(puzzle):
+    """An observer printing the puzzle after each round"""
+    print('-' * 40)
+    print(puzzle)
+
+
+def solve_clues(args):
+    """
+    Solve one puzzle of solve_file in a worker process.
+    Returns its number, the solved grid (or None if there's no solution)
+    and the line cache hits and misses while solving it.
+    """
+    number, row_clues, column_clues = args
+    before = line_cache_info()
+    puzzle = Puzzle(row_clues, column_clues)
+    grid = str(puzzle) if puzzle.search() else None
+    after = line_cache_info()
+    return (number, grid,
+            after.hits - before.hits, after.misses - before.misses)
+
+
+def read_puzzles(string):
+    """
+    Convert a string to a list of (row clues, column clues).
+    Blocks of clues in the format of str_to_clues_space are separated by
+    blank lines: each puzzle is a block of rows then a block of columns.
+    """
+    blocks = [str_to_clues_space(block.strip())
+              for block in string.strip().split('\n\n') if block.strip()]
+    return list(zip(blocks[::2], blocks[1::2]))
+
+
+def solve_file(path, output=sys.stdout, processes=None):
+    """
+    Solve every puzzle in a file (see read_puzzles) in a process pool,
+    writing each solution to output as soon as it is found.
+    Each worker keeps its line cache from one puzzle to the next.
+    Returns the total line cache hits and misses.
+    """
+    with open(path) as file:
+        puzzles = read_puzzles(file.read())
+
+    hits = misses = 0
+    with Pool(processes) as pool:
+        for number, grid, puzzle_hits, puzzle_misses in pool.imap_unordered(
+                solve_clues,
+                [(number,) + puzzle for number, puzzle in enumerate(puzzles)]):
+            if grid is None:
+                grid = 'no solution'
+            output.write('puzzle {}\n{}\n\n'.format(number, grid))
+            output.flush()
+            hits += puzzle_hits
+            misses += puzzle_misses
+    return (hits, misses)
 
 
 def str_to_clues(string):
@@ -182,3 +629,7 @@ def setup_3():
          [2, 2, 1, 2], [1, 1, 4, 1, 2, 1], [5, 1, 2, 2, 1], [1, 1, 1, 5, 1],
          [1, 7, 4]]
     )
+
+
+if __name__ == '__main__':
+    print('line cache hits: {}, misses: {}'.format(*solve_file(sys.argv[1])))